@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 from datetime import datetime
 
 from ...models.schemas import (
@@ -30,8 +30,11 @@ def _get_or_create_project_agents(project_id: str) -> dict[str, AgentStatusRespo
 
 
 @router.post("/trigger", response_model=AgentStatusResponse)
-async def trigger_agent(request: AgentTriggerRequest, background_tasks: BackgroundTasks):
+async def trigger_agent(request: AgentTriggerRequest):
     """Trigger a specific agent for a project."""
+    if not get_claude_bridge().accepting_runs:
+        raise HTTPException(status_code=503, detail="Server is shutting down")
+
     agents = _get_or_create_project_agents(request.project_id)
     agent_key = request.agent_type.value
 
@@ -49,13 +52,12 @@ async def trigger_agent(request: AgentTriggerRequest, background_tasks: Backgrou
         started_at=datetime.utcnow()
     )
 
-    # Run agent in background
-    background_tasks.add_task(
-        _run_agent,
+    # Run agent in background; the bridge drains it on shutdown
+    get_claude_bridge().start_run(_run_agent(
         request.project_id,
         request.agent_type,
         request.context
-    )
+    ))
 
     return agents[agent_key]
 
@@ -96,6 +98,23 @@ async def _run_agent(project_id: str, agent_type: AgentType, context: dict | Non
         )
 
 
+def interrupt_running_agents(reason: str) -> int:
+    """Mark agents left running by an interrupted background task as failed."""
+    interrupted = 0
+    for agents in _agent_states.values():
+        for agent_key, state in agents.items():
+            if state.status == AgentStatus.RUNNING:
+                agents[agent_key] = AgentStatusResponse(
+                    agent=state.agent,
+                    status=AgentStatus.FAILED,
+                    started_at=state.started_at,
+                    completed_at=datetime.utcnow(),
+                    error=reason
+                )
+                interrupted += 1
+    return interrupted
+
+
 def _build_agent_prompt(agent_type: AgentType, context: dict | None) -> str:
     """Build a prompt for the given agent type."""
     base_prompts = {
@@ -1,16 +1,28 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import asyncio
+import hashlib
+import json
+import re
+from typing import Callable
+from fastapi import APIRouter, HTTPException
 from datetime import datetime
 from uuid import uuid4
 
+from ...core.claude_bridge import get_claude_bridge
+from ...core.tracing import get_tracer
 from ...models.schemas import (
     ProjectCreate,
+    ProjectRebuild,
     ProjectResponse,
     ProjectListResponse,
     ProjectStatus,
     AgentPipelineStatus,
     AgentStatusResponse,
     AgentType,
-    AgentStatus
+    AgentStatus,
+    PipelineStartRequest,
+    ProjectTimeline,
+    TraceHotspot,
+    TraceSpan
 )
 
 router = APIRouter(prefix="/projects", tags=["projects"])
@@ -83,6 +95,7 @@ async def delete_project(project_id: str):
     if project_id not in _projects:
         raise HTTPException(status_code=404, detail="Project not found")
     del _projects[project_id]
+    _stage_results.pop(project_id, None)
 
 
 # In-memory pipeline states (shared with agents module in real implementation)
@@ -102,6 +115,34 @@ def _get_or_create_pipeline(project_id: str) -> dict[str, AgentStatusResponse]:
     return _pipeline_states[project_id]
 
 
+def _ensure_accepting_runs() -> None:
+    """Reject new pipeline runs once shutdown draining has started."""
+    if not get_claude_bridge().accepting_runs:
+        raise HTTPException(status_code=503, detail="Server is shutting down")
+
+
+def interrupt_running_pipelines(reason: str) -> int:
+    """Mark stages left running by an interrupted pipeline as failed."""
+    interrupted = 0
+    for project_id, agents in _pipeline_states.items():
+        for agent_key, state in agents.items():
+            if state.status == AgentStatus.RUNNING:
+                agents[agent_key] = AgentStatusResponse(
+                    agent=state.agent,
+                    status=AgentStatus.FAILED,
+                    started_at=state.started_at,
+                    completed_at=datetime.utcnow(),
+                    error=reason
+                )
+                interrupted += 1
+
+        project = _projects.get(project_id)
+        if project and project.status == ProjectStatus.IN_PROGRESS:
+            project.status = ProjectStatus.FAILED
+            project.updated_at = datetime.utcnow()
+    return interrupted
+
+
 @router.get("/{project_id}/pipeline", response_model=AgentPipelineStatus)
 async def get_project_pipeline(project_id: str):
     """Get the pipeline status for a project."""
@@ -122,47 +163,185 @@ async def get_project_pipeline(project_id: str):
 
 
 @router.post("/{project_id}/pipeline/start")
-async def start_project_pipeline(project_id: str, background_tasks: BackgroundTasks):
+async def start_project_pipeline(
+    project_id: str,
+    options: PipelineStartRequest | None = None
+):
     """Start the agent pipeline for a project."""
     if project_id not in _projects:
         raise HTTPException(status_code=404, detail="Project not found")
+    _ensure_accepting_runs()
+
+    with get_tracer().span("start_project_pipeline", project_id=project_id) as span:
+        # Initialize pipeline
+        agents = _get_or_create_pipeline(project_id)
+
+        # Update project status
+        _projects[project_id].status = ProjectStatus.IN_PROGRESS
+        _projects[project_id].updated_at = datetime.utcnow()
+
+        # Start the orchestrator agent
+        orchestrator_key = AgentType.ORCHESTRATOR.value
+        agents[orchestrator_key] = AgentStatusResponse(
+            agent=AgentType.ORCHESTRATOR,
+            status=AgentStatus.RUNNING,
+            started_at=datetime.utcnow()
+        )
+
+    # Run pipeline in background; the bridge drains it on shutdown
+    overlap = options.overlap if options else False
+    get_claude_bridge().start_run(
+        run_pipeline(project_id, overlap=overlap, trace_id=span.trace_id)
+    )
+
+    return {"message": "Pipeline started", "project_id": project_id}
+
+
+@router.post("/{project_id}/rebuild")
+async def rebuild_project(project_id: str, rebuild: ProjectRebuild):
+    """Update a project's prompt and re-run only the stages whose inputs changed."""
+    if project_id not in _projects:
+        raise HTTPException(status_code=404, detail="Project not found")
+    _ensure_accepting_runs()
 
-    # Initialize pipeline
     agents = _get_or_create_pipeline(project_id)
+    # A stage may be between runs while the pipeline is still in progress
+    if (
+        _projects[project_id].status == ProjectStatus.IN_PROGRESS
+        or any(state.status == AgentStatus.RUNNING for state in agents.values())
+    ):
+        raise HTTPException(
+            status_code=409,
+            detail="Pipeline is already running for this project"
+        )
 
-    # Update project status
-    _projects[project_id].status = ProjectStatus.IN_PROGRESS
-    _projects[project_id].updated_at = datetime.utcnow()
+    with get_tracer().span("rebuild_project", project_id=project_id) as span:
+        project = _projects[project_id]
+        if rebuild.prompt:
+            project.prompt = rebuild.prompt
+        project.status = ProjectStatus.IN_PROGRESS
+        project.updated_at = datetime.utcnow()
 
-    # Start the orchestrator agent
-    orchestrator_key = AgentType.ORCHESTRATOR.value
-    agents[orchestrator_key] = AgentStatusResponse(
-        agent=AgentType.ORCHESTRATOR,
-        status=AgentStatus.RUNNING,
-        started_at=datetime.utcnow()
+        # Reset stage states; run_pipeline marks each stage as reused or re-run
+        for agent in AgentType:
+            agents[agent.value] = AgentStatusResponse(
+                agent=agent,
+                status=AgentStatus.IDLE
+            )
+        agents[AgentType.ORCHESTRATOR.value] = AgentStatusResponse(
+            agent=AgentType.ORCHESTRATOR,
+            status=AgentStatus.RUNNING,
+            started_at=datetime.utcnow()
+        )
+
+    get_claude_bridge().start_run(run_pipeline(
+        project_id,
+        reuse_results=True,
+        overlap=rebuild.overlap,
+        trace_id=span.trace_id
+    ))
+
+    return {"message": "Rebuild started", "project_id": project_id}
+
+
+@router.get("/{project_id}/trace")
+async def get_project_trace(project_id: str):
+    """Get a project's raw spans in Chrome Trace Event Format (loads in Perfetto)."""
+    return {"traceEvents": get_tracer().get_project_events(project_id)}
+
+
+@router.get("/{project_id}/timeline", response_model=ProjectTimeline)
+async def get_project_timeline(project_id: str):
+    """Get a project's spans as a waterfall, with the slowest operations first in hotspots."""
+    events = sorted(get_tracer().get_project_events(project_id), key=lambda e: e["ts"])
+    if not events:
+        return ProjectTimeline(
+            project_id=project_id,
+            trace_ids=[],
+            duration_ms=0,
+            spans=[],
+            hotspots=[]
+        )
+
+    origin = events[0]["ts"]
+    parents = {e["args"]["span_id"]: e["args"]["parent_id"] for e in events}
+
+    def depth(span_id: str) -> int:
+        level = 0
+        while parents.get(span_id):
+            span_id = parents[span_id]
+            level += 1
+        return level
+
+    spans = []
+    totals: dict[str, list[float]] = {}
+    reserved = {"trace_id", "span_id", "parent_id", "project_id"}
+    for event in events:
+        args = event["args"]
+        duration_ms = event["dur"] / 1000
+        spans.append(TraceSpan(
+            name=event["name"],
+            trace_id=args["trace_id"],
+            span_id=args["span_id"],
+            parent_id=args["parent_id"],
+            depth=depth(args["span_id"]),
+            start_ms=(event["ts"] - origin) / 1000,
+            duration_ms=duration_ms,
+            attributes={k: v for k, v in args.items() if k not in reserved}
+        ))
+        totals.setdefault(event["name"], []).append(duration_ms)
+
+    hotspots = sorted(
+        (
+            TraceHotspot(name=name, count=len(durations), total_ms=sum(durations))
+            for name, durations in totals.items()
+        ),
+        key=lambda hotspot: hotspot.total_ms,
+        reverse=True
     )
 
-    # Run pipeline in background
-    background_tasks.add_task(run_pipeline, project_id)
+    return ProjectTimeline(
+        project_id=project_id,
+        trace_ids=list(dict.fromkeys(span.trace_id for span in spans)),
+        duration_ms=max(span.start_ms + span.duration_ms for span in spans),
+        spans=spans,
+        hotspots=hotspots
+    )
 
-    return {"message": "Pipeline started", "project_id": project_id}
 
+# Bump to invalidate stored stage results when agent behaviour changes
+# outside the prompt templates below (e.g. agent definitions, CLI flags).
+PROMPT_TEMPLATE_VERSION = "1"
 
-async def run_pipeline(project_id: str):
-    """Background task to run the agent pipeline using Claude CLI."""
-    from ...core.claude_bridge import get_claude_bridge
+AGENT_ORDER = [
+    AgentType.ORCHESTRATOR,
+    AgentType.DESIGN,
+    AgentType.FRONTEND,
+    AgentType.BACKEND,
+    AgentType.DEVOPS,
+]
 
-    agents = _pipeline_states.get(project_id, {})
-    project = _projects.get(project_id)
+# Handover fields a stage needs from the stage before it. In overlap mode
+# the stage is launched as soon as the upstream agent has streamed these
+# fields; stages without an entry wait for every earlier run to finish.
+# Earlier stages that are still running are handed over only as the
+# fields they have streamed, not their full output.
+STAGE_HANDOVER_FIELDS: dict[AgentType, list[str]] = {
+    AgentType.DESIGN: ["tech_stack", "features"],
+    AgentType.FRONTEND: ["color_palette", "components"],
+    AgentType.BACKEND: ["api_endpoints"],
+}
 
-    if not project:
-        return
+HANDOVER_LINE = re.compile(r"^@handover\s+(\w+)\s+(.+)$", re.MULTILINE)
+
+# Last successful result of each stage, keyed by project then agent.
+# Each entry holds the input fingerprint and the agent output.
+_stage_results: dict[str, dict[str, dict]] = {}
 
-    bridge = get_claude_bridge()
-    user_prompt = project.prompt
 
-    # Agent prompts for each phase
-    agent_prompts = {
+def _build_agent_prompts(user_prompt: str) -> dict[AgentType, str]:
+    """Render the prompt for each pipeline stage."""
+    return {
         AgentType.ORCHESTRATOR: f"""You are the Project Orchestrator. Analyze this project request and create a detailed development plan.
 
 User Request: {user_prompt}
@@ -225,72 +404,324 @@ Create:
 Use the GitHub MCP to create a new repository and push the code."""
     }
 
-    agent_order = [
-        AgentType.ORCHESTRATOR,
-        AgentType.DESIGN,
-        AgentType.FRONTEND,
-        AgentType.BACKEND,
-        AgentType.DEVOPS,
-    ]
 
-    context = {"user_prompt": user_prompt}
+def _stage_fingerprint(agent_type: AgentType, context: dict) -> str:
+    """
+    Fingerprint everything a stage's output depends on.
+
+    Every stage sees the raw user prompt, but only the orchestrator's output
+    is derived from it directly; later stages build on the handed-over plan.
+    The prompt is therefore left out of their fingerprint, so a prompt edit
+    that leaves the plan unchanged leaves them reusable. The template is
+    fingerprinted rather than the prompt as sent, so the handover
+    instructions added in overlap mode don't count either.
+    """
+    user_prompt = context.get("user_prompt", "")
+    if agent_type != AgentType.ORCHESTRATOR:
+        user_prompt = "{user_prompt}"
+    handover = {key: value for key, value in context.items() if key != "user_prompt"}
+    payload = json.dumps(
+        {
+            "template_version": PROMPT_TEMPLATE_VERSION,
+            "prompt": _build_agent_prompts(user_prompt)[agent_type],
+            "context": handover,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _handover_instructions(fields: list[str]) -> str:
+    """Ask an upstream agent to stream the fields its successor starts from."""
+    return (
+        "\n\nAs soon as each of the following handover fields is final, emit it "
+        "on its own line as `@handover <field> <single-line JSON value>`, "
+        "before continuing with the rest of your work: "
+        + ", ".join(fields)
+    )
+
+
+def _parse_handover_fields(chunk: str) -> dict:
+    """
+    Extract `@handover <field> <value>` lines from one chunk of streamed
+    agent output.
+
+    Chunks are whole assistant messages, so each one ends a line. Values
+    that aren't valid JSON are skipped rather than treated as ready.
+    """
+    fields = {}
+    for match in HANDOVER_LINE.finditer(chunk):
+        name, raw_value = match.group(1), match.group(2).strip()
+        try:
+            fields[name] = json.loads(raw_value)
+        except ValueError:
+            continue
+    return fields
+
+
+def _result_text(output: str) -> str:
+    """
+    Extract the agent's answer from the CLI's JSON result envelope.
+
+    The envelope also carries per-run metadata (session id, duration,
+    cost), which must not reach the handover context or the fingerprints
+    of later stages. Output that isn't an envelope is returned unchanged.
+    """
+    try:
+        envelope = json.loads(output)
+    except ValueError:
+        return output
+    if isinstance(envelope, dict) and isinstance(envelope.get("result"), str):
+        return envelope["result"]
+    return output
+
+
+def _store_stage_result(
+    project_id: str,
+    agent_type: AgentType,
+    context: dict,
+    output: str
+) -> None:
+    """Record a stage's output for reuse, keyed by its input fingerprint."""
+    _stage_results.setdefault(project_id, {})[agent_type.value] = {
+        "fingerprint": _stage_fingerprint(agent_type, context),
+        "output": output
+    }
 
-    for agent_type in agent_order:
-        agent_key = agent_type.value
 
-        # Set agent to running
+async def _run_stage(
+    project_id: str,
+    agent_type: AgentType,
+    prompt: str,
+    context: dict,
+    reuse_results: bool,
+    on_output: Callable[[str], None] | None = None,
+    final_inputs: bool = True
+) -> str | None:
+    """
+    Run (or reuse) a single pipeline stage and record its status.
+
+    When final_inputs is False the context holds partial handovers from
+    stages that are still running. Such a run can't match a stored result
+    and isn't stored; the caller stores it once the inputs are final.
+
+    Returns the stage output, or None if the stage failed.
+    """
+    agents = _pipeline_states[project_id]
+    stored_results = _stage_results.setdefault(project_id, {})
+    agent_key = agent_type.value
+
+    stored = stored_results.get(agent_key)
+    if (
+        reuse_results
+        and final_inputs
+        and stored
+        and stored["fingerprint"] == _stage_fingerprint(agent_type, context)
+    ):
+        now = datetime.utcnow()
         agents[agent_key] = AgentStatusResponse(
             agent=agent_type,
-            status=AgentStatus.RUNNING,
-            started_at=datetime.utcnow()
+            status=AgentStatus.COMPLETED,
+            started_at=now,
+            completed_at=now,
+            output=stored["output"][:500] if stored["output"] else "Completed",
+            reused=True
         )
+        return stored["output"]
 
-        try:
-            # Call Claude CLI
-            result = await bridge.invoke_agent(
-                agent_name=agent_key,
-                prompt=agent_prompts[agent_type],
-                project_id=project_id,
-                context=context
-            )
-
-            # Update context with this agent's output for next agent
-            context[agent_key] = result.get("output", "")
+    # Set agent to running
+    agents[agent_key] = AgentStatusResponse(
+        agent=agent_type,
+        status=AgentStatus.RUNNING,
+        started_at=datetime.utcnow()
+    )
 
-            # Set agent status based on result
-            if result["success"]:
-                agents[agent_key] = AgentStatusResponse(
-                    agent=agent_type,
-                    status=AgentStatus.COMPLETED,
-                    started_at=agents[agent_key].started_at,
-                    completed_at=datetime.utcnow(),
-                    output=result["output"][:500] if result["output"] else "Completed"
-                )
-            else:
-                agents[agent_key] = AgentStatusResponse(
-                    agent=agent_type,
-                    status=AgentStatus.FAILED,
-                    started_at=agents[agent_key].started_at,
-                    completed_at=datetime.utcnow(),
-                    error=result.get("error", "Unknown error")
-                )
-                # Stop pipeline on failure
-                project.status = ProjectStatus.FAILED
-                project.updated_at = datetime.utcnow()
-                return
+    try:
+        # Call Claude CLI
+        result = await get_claude_bridge().invoke_agent(
+            agent_name=agent_key,
+            prompt=prompt,
+            project_id=project_id,
+            context=context,
+            on_output=on_output
+        )
 
-        except Exception as e:
+        # Set agent status based on result
+        if result["success"]:
+            output = _result_text(result.get("output", ""))
+            if final_inputs:
+                _store_stage_result(project_id, agent_type, context, output)
             agents[agent_key] = AgentStatusResponse(
                 agent=agent_type,
-                status=AgentStatus.FAILED,
+                status=AgentStatus.COMPLETED,
                 started_at=agents[agent_key].started_at,
                 completed_at=datetime.utcnow(),
-                error=str(e)
+                output=output[:500] if output else "Completed"
             )
-            project.status = ProjectStatus.FAILED
-            project.updated_at = datetime.utcnow()
-            return
+            return output
+
+        stored_results.pop(agent_key, None)
+        agents[agent_key] = AgentStatusResponse(
+            agent=agent_type,
+            status=AgentStatus.FAILED,
+            started_at=agents[agent_key].started_at,
+            completed_at=datetime.utcnow(),
+            error=result.get("error", "Unknown error")
+        )
+        return None
+
+    except asyncio.CancelledError:
+        agents[agent_key] = AgentStatusResponse(
+            agent=agent_type,
+            status=AgentStatus.FAILED,
+            started_at=agents[agent_key].started_at,
+            completed_at=datetime.utcnow(),
+            error="Cancelled before completion"
+        )
+        raise
+
+    except Exception as e:
+        stored_results.pop(agent_key, None)
+        agents[agent_key] = AgentStatusResponse(
+            agent=agent_type,
+            status=AgentStatus.FAILED,
+            started_at=agents[agent_key].started_at,
+            completed_at=datetime.utcnow(),
+            error=str(e)
+        )
+        return None
+
+
+async def _run_sequential(
+    project_id: str,
+    agent_prompts: dict[AgentType, str],
+    context: dict,
+    reuse_results: bool
+) -> bool:
+    """Run each stage after the previous one has fully completed."""
+    for agent_type in AGENT_ORDER:
+        output = await _run_stage(
+            project_id, agent_type, agent_prompts[agent_type], context, reuse_results
+        )
+        if output is None:
+            return False
+        # Update context with this agent's output for next agent
+        context[agent_type.value] = output
+    return True
+
+
+async def _run_overlapped(
+    project_id: str,
+    agent_prompts: dict[AgentType, str],
+    context: dict,
+    reuse_results: bool
+) -> bool:
+    """
+    Launch each stage as soon as its upstream has streamed the handover
+    fields listed in STAGE_HANDOVER_FIELDS.
+
+    Stages without declared fields wait for every earlier stage to finish,
+    not just the one before them.
+    A launched stage sees the fields streamed so far by every stage that is
+    still running in place of its full output, so it may start with only
+    part of an earlier stage's plan. Its result is stored against the final
+    outputs of those stages, as a sequential run would store it, so later
+    rebuilds in either mode can reuse it. If any stage fails, the stages
+    still waiting or running are cancelled.
+    """
+    ready = {agent_type: asyncio.Event() for agent_type in AGENT_ORDER}
+    completed = {agent_type: asyncio.Event() for agent_type in AGENT_ORDER}
+    streamed: dict[AgentType, dict] = {agent_type: {} for agent_type in AGENT_ORDER}
+
+    async def run(index: int) -> bool:
+        agent_type = AGENT_ORDER[index]
+        upstream = AGENT_ORDER[index - 1] if index > 0 else None
+        downstream = AGENT_ORDER[index + 1] if index + 1 < len(AGENT_ORDER) else None
+
+        if agent_type in STAGE_HANDOVER_FIELDS:
+            await ready[upstream].wait()
+        else:
+            await asyncio.gather(*(completed[a].wait() for a in AGENT_ORDER[:index]))
+
+        ancestors = AGENT_ORDER[:index]
+        running = [ancestor for ancestor in ancestors if ancestor.value not in context]
+        stage_context = dict(context)
+        for ancestor in running:
+            stage_context[ancestor.value] = {"partial": True, **streamed[ancestor]}
+
+        prompt = agent_prompts[agent_type]
+        on_output = None
+        needed = STAGE_HANDOVER_FIELDS.get(downstream, []) if downstream else []
+        if needed:
+            prompt += _handover_instructions(needed)
+
+            def on_output(text: str) -> None:
+                streamed[agent_type].update(_parse_handover_fields(text))
+                if all(field in streamed[agent_type] for field in needed):
+                    ready[agent_type].set()
+
+        output = await _run_stage(
+            project_id, agent_type, prompt, stage_context, reuse_results, on_output,
+            final_inputs=not running
+        )
+        if output is None:
+            return False
+
+        context[agent_type.value] = output
+        ready[agent_type].set()
+        completed[agent_type].set()
+
+        if running:
+            await asyncio.gather(*(completed[a].wait() for a in running))
+            final_context = {"user_prompt": context["user_prompt"]}
+            final_context.update((a.value, context[a.value]) for a in ancestors)
+            _store_stage_result(project_id, agent_type, final_context, output)
+        return True
+
+    tasks = [asyncio.create_task(run(index)) for index in range(len(AGENT_ORDER))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if not await next_done:
+                return False
+        return True
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_pipeline(
+    project_id: str,
+    reuse_results: bool = False,
+    overlap: bool = False,
+    trace_id: str | None = None
+):
+    """
+    Background task to run the agent pipeline using Claude CLI.
+
+    With reuse_results, stages whose input fingerprint matches their last
+    successful run are not re-executed; the stored output is handed over
+    instead. With overlap, stages start from streamed upstream handover
+    fields (see _run_overlapped). trace_id continues the trace of the
+    request that scheduled the run.
+    """
+    project = _projects.get(project_id)
+
+    if not project or project_id not in _pipeline_states:
+        return
+
+    agent_prompts = _build_agent_prompts(project.prompt)
+    context = {"user_prompt": project.prompt}
+
+    run_stages = _run_overlapped if overlap else _run_sequential
+    with get_tracer().span(
+        "run_pipeline",
+        project_id=project_id,
+        trace_id=trace_id,
+        reuse_results=reuse_results,
+        overlap=overlap
+    ):
+        succeeded = await run_stages(project_id, agent_prompts, context, reuse_results)
 
-    # All agents completed successfully
-    project.status = ProjectStatus.COMPLETED
+    project.status = ProjectStatus.COMPLETED if succeeded else ProjectStatus.FAILED
     project.updated_at = datetime.utcnow()
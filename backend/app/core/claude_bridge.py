@@ -1,10 +1,60 @@
 import asyncio
+import hashlib
 import json
+import logging
+import os
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Coroutine, Optional
 from datetime import datetime
 
 from .config import get_settings
+from .tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# stream-json events carry the whole final result on one line, which can
+# exceed asyncio's default 64 KiB line limit.
+STREAM_LINE_LIMIT = 16 * 1024 * 1024
+
+# Seconds to wait for `claude --version` at startup; a CLI stuck on an auth
+# or update prompt must not block the app from starting.
+PREFLIGHT_TIMEOUT = 10.0
+
+# Seconds drain() gives background runs to wind down once their agents
+# have finished or been interrupted, before cancelling them.
+RUN_UNWIND_TIMEOUT = 5.0
+
+
+class _Flight:
+    """An agent run shared by concurrent identical invocations."""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self._chunks: list[str] = []
+        self._subscribers: list[Callable[[str], None]] = []
+
+    def publish(self, text: str) -> None:
+        self._chunks.append(text)
+        for subscriber in list(self._subscribers):
+            # One caller's broken callback must not fail the shared run
+            try:
+                subscriber(text)
+            except Exception:
+                logger.exception("Agent output subscriber failed")
+
+    def subscribe(self, on_output: Callable[[str], None]) -> None:
+        """Replay output streamed so far, then forward new output."""
+        for text in self._chunks:
+            try:
+                on_output(text)
+            except Exception:
+                logger.exception("Agent output subscriber failed")
+        self._subscribers.append(on_output)
+
+    def unsubscribe(self, on_output: Callable[[str], None]) -> None:
+        self._subscribers.remove(on_output)
 
 
 class ClaudeBridge:
@@ -14,6 +64,19 @@ class ClaudeBridge:
         self.settings = get_settings()
         self.logs_dir = Path(self.settings.agent_logs_dir)
         self.logs_dir.mkdir(exist_ok=True)
+        self.tracer = get_tracer()
+
+        # Set by preflight() during application startup
+        self.cli_version: Optional[str] = None
+        # Cleared by drain() during application shutdown
+        self.accepting_runs = True
+        # Log entries of in-flight invocations, checkpointed if interrupted
+        self._active_runs: dict[int, dict] = {}
+        self._processes: set[asyncio.subprocess.Process] = set()
+        # Background runs (pipelines, triggered agents) drained on shutdown
+        self._runs: set[asyncio.Task] = set()
+        # Runs shared by concurrent identical invocations
+        self._flights: dict[tuple[str, str, bool, str], _Flight] = {}
 
     async def invoke_agent(
         self,
@@ -21,7 +84,8 @@ class ClaudeBridge:
         prompt: str,
         project_id: str,
         working_dir: Optional[str] = None,
-        context: Optional[dict] = None
+        context: Optional[dict] = None,
+        on_output: Optional[Callable[[str], None]] = None
     ) -> dict:
         """
         Invoke a Claude Code agent with the given prompt.
@@ -32,71 +96,182 @@ class ClaudeBridge:
             project_id: Unique project identifier for tracking
             working_dir: Working directory for the agent
             context: Previous agent context for handover
+            on_output: Called with each chunk of assistant text while the
+                agent is still running; switches the CLI to streamed output
 
         Returns:
             dict with status, output, and handover context
-        """
-        # Prepare the full prompt with context if provided
-        full_prompt = prompt
-        if context:
-            context_str = json.dumps(context, indent=2)
-            full_prompt = f"Previous agent context:\n```json\n{context_str}\n```\n\n{prompt}"
-
-        # Build the claude command
-        # Format: claude -p "prompt" --print --output-format json
-        cmd = [
-            self.settings.claude_cli_path,
-            "-p", full_prompt,
-            "--print",
-            "--output-format", "json",
-        ]
-
-        if working_dir:
-            cmd.extend(["--cwd", working_dir])
-
-        # Log the invocation
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "project_id": project_id,
-            "agent": agent_name,
-            "prompt": prompt[:500],  # Truncate for logging
-            "status": "started"
-        }
-        self._write_log(project_id, log_entry)
-
-        try:
-            # Run the agent
-            result = await self._run_command(cmd, working_dir)
-
-            # Update log with result
-            log_entry.update({
-                "status": "completed",
-                "exit_code": result["exit_code"]
-            })
-            self._write_log(project_id, log_entry)
 
+        Concurrent calls with the same project, agent, inputs and output
+        mode (streamed or not) share a single CLI run: later callers attach to the in-flight one, get the
+        output it has streamed so far replayed, and receive the same result.
+        """
+        if not self.accepting_runs:
             return {
-                "success": result["exit_code"] == 0,
-                "output": result["stdout"],
-                "error": result["stderr"],
+                "success": False,
+                "output": "",
+                "error": "Server is shutting down",
                 "agent": agent_name,
                 "project_id": project_id
             }
 
-        except Exception as e:
-            log_entry.update({
-                "status": "failed",
-                "error": str(e)
-            })
-            self._write_log(project_id, log_entry)
+        # A run without on_output uses the plain JSON format and streams
+        # nothing, so streaming callers can't attach to it
+        key = (
+            project_id,
+            agent_name,
+            on_output is not None,
+            self._input_fingerprint(prompt, working_dir, context)
+        )
+        flight = self._flights.get(key)
+        if flight is None or flight.task.done() or flight.task.cancelling():
+            flight = _Flight()
+            flight.task = asyncio.create_task(self._invoke_agent(
+                agent_name,
+                prompt,
+                project_id,
+                working_dir,
+                context,
+                flight.publish if on_output else None
+            ))
+            flight.task.add_done_callback(lambda _, f=flight: self._end_flight(key, f))
+            self._flights[key] = flight
 
-            return {
-                "success": False,
-                "output": "",
-                "error": str(e),
+        if on_output:
+            flight.subscribe(on_output)
+        flight.waiters += 1
+        try:
+            return dict(await asyncio.shield(flight.task))
+        except asyncio.CancelledError:
+            # Only stop the shared run once nobody is waiting for it, and stop
+            # new identical calls from attaching while it winds down
+            if flight.waiters == 1:
+                flight.task.cancel()
+                self._end_flight(key, flight)
+            raise
+        finally:
+            flight.waiters -= 1
+            if on_output:
+                flight.unsubscribe(on_output)
+
+    def _end_flight(self, key: tuple[str, str, bool, str], flight: "_Flight") -> None:
+        """Stop routing identical calls to flight, unless a newer one took over."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _invoke_agent(
+        self,
+        agent_name: str,
+        prompt: str,
+        project_id: str,
+        working_dir: Optional[str],
+        context: Optional[dict],
+        on_output: Optional[Callable[[str], None]]
+    ) -> dict:
+        """Run a single agent invocation; see invoke_agent."""
+        with self.tracer.span("invoke_agent", project_id=project_id, agent=agent_name) as span:
+            # Prepare the full prompt with context if provided
+            full_prompt = prompt
+            if context:
+                with self.tracer.span("serialize_handover"):
+                    context_str = json.dumps(context, indent=2)
+                full_prompt = f"Previous agent context:\n```json\n{context_str}\n```\n\n{prompt}"
+
+            # Build the claude command
+            # Format: claude -p "prompt" --print --output-format json
+            cmd = [
+                self.settings.claude_cli_path,
+                "-p", full_prompt,
+                "--print",
+            ]
+            if on_output:
+                cmd.extend(["--output-format", "stream-json", "--verbose"])
+            else:
+                cmd.extend(["--output-format", "json"])
+
+            if working_dir:
+                cmd.extend(["--cwd", working_dir])
+
+            # Log the invocation
+            log_entry = {
+                "timestamp": datetime.utcnow().isoformat(),
+                "project_id": project_id,
                 "agent": agent_name,
-                "project_id": project_id
+                "prompt": prompt[:500],  # Truncate for logging
+                "status": "started",
+                "trace_id": span.trace_id,
+                "span_id": span.span_id
             }
+            self._write_log(project_id, log_entry)
+            self._active_runs[id(log_entry)] = log_entry
+
+            try:
+                # Run the agent
+                if on_output:
+                    result = await self._stream_command(cmd, working_dir, on_output)
+                else:
+                    result = await self._run_command(cmd, working_dir)
+
+                # drain() already checkpointed this run and killed the CLI
+                if log_entry["status"] == "interrupted":
+                    return {
+                        "success": False,
+                        "output": "",
+                        "error": log_entry["error"],
+                        "agent": agent_name,
+                        "project_id": project_id
+                    }
+
+                # Update log with result
+                log_entry.update({
+                    "status": "completed",
+                    "exit_code": result["exit_code"]
+                })
+                self._write_log(project_id, log_entry)
+
+                return {
+                    "success": result["exit_code"] == 0,
+                    "output": result["stdout"],
+                    "error": result["stderr"],
+                    "agent": agent_name,
+                    "project_id": project_id
+                }
+
+            except Exception as e:
+                log_entry.update({
+                    "status": "failed",
+                    "error": str(e)
+                })
+                self._write_log(project_id, log_entry)
+
+                return {
+                    "success": False,
+                    "output": "",
+                    "error": str(e),
+                    "agent": agent_name,
+                    "project_id": project_id
+                }
+
+            except asyncio.CancelledError:
+                self._interrupt(log_entry, "Cancelled before completion")
+                raise
+
+            finally:
+                self._active_runs.pop(id(log_entry), None)
+
+    @staticmethod
+    def _input_fingerprint(
+        prompt: str,
+        working_dir: Optional[str],
+        context: Optional[dict]
+    ) -> str:
+        """Fingerprint the inputs that determine an invocation's result."""
+        payload = json.dumps(
+            {"prompt": prompt, "working_dir": working_dir, "context": context},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
     async def _run_command(
         self,
@@ -104,14 +279,26 @@ class ClaudeBridge:
         working_dir: Optional[str] = None
     ) -> dict:
         """Run a command asynchronously."""
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=working_dir
-        )
+        with self.tracer.span("run_command") as span:
+            with self.tracer.span("spawn_process"):
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=working_dir
+                )
+            self._processes.add(process)
 
-        stdout, stderr = await process.communicate()
+            try:
+                stdout, stderr = await process.communicate()
+            finally:
+                # Don't leave the CLI running when the caller gives up on it
+                # or reading its output fails
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                self._processes.discard(process)
+            span.attributes["exit_code"] = process.returncode
 
         return {
             "stdout": stdout.decode("utf-8"),
@@ -119,23 +306,218 @@ class ClaudeBridge:
             "exit_code": process.returncode
         }
 
+    async def _stream_command(
+        self,
+        cmd: list[str],
+        working_dir: Optional[str],
+        on_output: Callable[[str], None]
+    ) -> dict:
+        """
+        Run a stream-json command, forwarding assistant text as it arrives.
+
+        The returned stdout is the final result event, which has the same
+        shape as the single object printed by --output-format json.
+        """
+        with self.tracer.span("stream_command") as span:
+            with self.tracer.span("spawn_process"):
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=working_dir,
+                    limit=STREAM_LINE_LIMIT
+                )
+            self._processes.add(process)
+            started = time.perf_counter()
+            stderr_task = asyncio.create_task(process.stderr.read())
+
+            lines = []
+            result_line = None
+            try:
+                async for raw_line in process.stdout:
+                    line = raw_line.decode("utf-8")
+                    lines.append(line)
+                    if len(lines) == 1:
+                        # Approximates CLI startup before any model output
+                        span.attributes["first_output_ms"] = round(
+                            (time.perf_counter() - started) * 1000, 1
+                        )
+
+                    event = self._parse_stream_event(line)
+                    if event is None:
+                        on_output(line)
+                    elif event.get("type") == "result":
+                        result_line = line.strip()
+                    elif event.get("type") == "assistant":
+                        text = "".join(
+                            block.get("text", "")
+                            for block in event.get("message", {}).get("content", [])
+                            if block.get("type") == "text"
+                        )
+                        if text:
+                            on_output(text)
+
+                stderr = await stderr_task
+                await process.wait()
+            finally:
+                # Don't leave the CLI running when the caller gives up on it,
+                # a callback raises or a line overruns STREAM_LINE_LIMIT
+                stderr_task.cancel()
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                self._processes.discard(process)
+            span.attributes["exit_code"] = process.returncode
+
+        return {
+            "stdout": result_line if result_line is not None else "".join(lines),
+            "stderr": stderr.decode("utf-8"),
+            "exit_code": process.returncode
+        }
+
+    @staticmethod
+    def _parse_stream_event(line: str) -> Optional[dict]:
+        """Parse a stream-json event line, or None if it isn't one."""
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return None
+        return event if isinstance(event, dict) else None
+
+    def start_run(self, coro: Coroutine) -> asyncio.Task:
+        """
+        Run a background coroutine, such as a pipeline, as a task the bridge
+        owns, so that drain() can wait for it on shutdown.
+        """
+        task = asyncio.create_task(coro)
+        self._runs.add(task)
+        task.add_done_callback(self._runs.discard)
+        return task
+
+    async def preflight(self) -> Optional[str]:
+        """Check that the Claude CLI runs and cache its version."""
+        try:
+            # On timeout _run_command is cancelled, which kills the CLI
+            result = await asyncio.wait_for(
+                self._run_command([self.settings.claude_cli_path, "--version"]),
+                timeout=PREFLIGHT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+        if result["exit_code"] == 0:
+            self.cli_version = result["stdout"].strip()
+        return self.cli_version
+
+    def reconcile_interrupted_logs(self) -> int:
+        """
+        Checkpoint invocations a previous process left in the 'started' state.
+
+        Returns the number of invocations marked as interrupted.
+        """
+        active = {(e["agent"], e["timestamp"]) for e in self._active_runs.values()}
+        interrupted = 0
+        for log_file in self.logs_dir.glob("*.jsonl"):
+            self._terminate_torn_line(log_file)
+            open_runs = {}
+            for entry in self.get_project_logs(log_file.stem):
+                run_key = (entry.get("agent"), entry.get("timestamp"))
+                if entry.get("status") == "started":
+                    open_runs[run_key] = entry
+                else:
+                    open_runs.pop(run_key, None)
+
+            for run_key, entry in open_runs.items():
+                if run_key not in active:
+                    self._interrupt(entry, "Server restarted before the agent finished")
+                    interrupted += 1
+        return interrupted
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Stop accepting runs and wait up to timeout seconds for in-flight
+        invocations to finish. Background runs can't start further agents
+        meanwhile. Invocations still running afterwards are checkpointed as
+        interrupted and their CLI processes killed, then background runs get
+        RUN_UNWIND_TIMEOUT seconds to record the outcome before being
+        cancelled.
+
+        Returns the number of invocations that were interrupted.
+        """
+        self.accepting_runs = False
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._active_runs and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        remaining = list(self._active_runs.values())
+        for entry in remaining:
+            self._interrupt(entry, "Interrupted by server shutdown")
+
+        processes = [p for p in self._processes if p.returncode is None]
+        for process in processes:
+            process.kill()
+        await asyncio.gather(*(p.wait() for p in processes))
+
+        if self._runs:
+            _, pending = await asyncio.wait(self._runs, timeout=RUN_UNWIND_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        return len(remaining)
+
+    @staticmethod
+    def _terminate_torn_line(log_file: Path) -> None:
+        """
+        End a line left unfinished by a crash mid-write, so entries appended
+        afterwards start on a line of their own.
+        """
+        with open(log_file, "rb+") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def _interrupt(self, log_entry: dict, reason: str) -> None:
+        """Record that an invocation will not complete."""
+        if log_entry["status"] == "interrupted":
+            return
+        log_entry.update({
+            "status": "interrupted",
+            "error": reason
+        })
+        self._write_log(log_entry["project_id"], log_entry)
+
     def _write_log(self, project_id: str, entry: dict) -> None:
         """Write a log entry for the project."""
         log_file = self.logs_dir / f"{project_id}.jsonl"
-        with open(log_file, "a") as f:
-            f.write(json.dumps(entry) + "\n")
+        with self.tracer.span("write_log", project_id=project_id):
+            with open(log_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
 
     def get_project_logs(self, project_id: str) -> list[dict]:
-        """Get all log entries for a project."""
+        """
+        Get all log entries for a project.
+
+        Lines that aren't valid JSON, such as one torn by a crash mid-write,
+        are logged and skipped.
+        """
         log_file = self.logs_dir / f"{project_id}.jsonl"
         if not log_file.exists():
             return []
 
         logs = []
         with open(log_file) as f:
-            for line in f:
-                if line.strip():
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
                     logs.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping undecodable line %d of %s", line_number, log_file)
         return logs
 
 
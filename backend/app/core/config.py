@@ -22,6 +22,13 @@ class Settings(BaseSettings):
     # Agent Configuration
     agent_logs_dir: str = ".agent_logs"
 
+    # Tracing
+    tracing_enabled: bool = True
+    agent_traces_dir: str = ".agent_traces"
+
+    # Seconds to let in-flight agents finish on shutdown before interrupting them
+    shutdown_drain_timeout: float = 30.0
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+from uuid import uuid4
+
+from .config import get_settings
+
+
+class Span:
+    """A timed operation within a pipeline trace."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent: Optional["Span"] = None,
+        project_id: Optional[str] = None,
+        attributes: Optional[dict] = None
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.project_id = project_id
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.duration = 0.0
+
+    def to_event(self) -> dict:
+        """Render as a Chrome Trace Event Format complete event."""
+        task = asyncio.current_task() if _in_event_loop() else None
+        return {
+            "name": self.name,
+            "cat": "pipeline",
+            "ph": "X",
+            "ts": int(self.start * 1_000_000),
+            "dur": int(self.duration * 1_000_000),
+            "pid": os.getpid(),
+            # One lane per asyncio task so overlapping stages don't interleave
+            "tid": id(task) if task else threading.get_ident(),
+            "args": {
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "project_id": self.project_id,
+                **self.attributes
+            }
+        }
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Records spans and exports them per project as Chrome Trace Event
+    Format events, one JSON object per line.
+
+    The files load directly in chrome://tracing or Perfetto once wrapped
+    as {"traceEvents": [...]}, which is what the trace endpoint returns.
+    """
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.enabled = self.settings.tracing_enabled
+        self.traces_dir = Path(self.settings.agent_traces_dir)
+        if self.enabled:
+            self.traces_dir.mkdir(exist_ok=True)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        project_id: Optional[str] = None,
+        trace_id: Optional[str] = None,
+        **attributes
+    ) -> Iterator[Span]:
+        """
+        Time the enclosed block as a child of the current span.
+
+        A new trace is started when there is no current span and no
+        trace_id is given. project_id is inherited from the parent span.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=trace_id or (parent.trace_id if parent else uuid4().hex),
+            parent=parent,
+            project_id=project_id or (parent.project_id if parent else None),
+            attributes=attributes
+        )
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = repr(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._export(span)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _export(self, span: Span) -> None:
+        """Append a finished span to its project's trace file."""
+        if not self.enabled or not span.project_id:
+            return
+        trace_file = self.traces_dir / f"{span.project_id}.jsonl"
+        with open(trace_file, "a") as f:
+            f.write(json.dumps(span.to_event(), default=str) + "\n")
+
+    def get_project_events(self, project_id: str) -> list[dict]:
+        """Get all exported trace events for a project."""
+        trace_file = self.traces_dir / f"{project_id}.jsonl"
+        if not trace_file.exists():
+            return []
+
+        events = []
+        with open(trace_file) as f:
+            for line in f:
+                if line.strip():
+                    events.append(json.loads(line))
+        return events
+
+
+# Singleton instance
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
@@ -1,15 +1,56 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .core.config import get_settings
+from .core.claude_bridge import get_claude_bridge
+from .core.tracing import get_tracer
 from .api.routes import health, projects, agents
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: create the log/trace dirs and warm the CLI before the first
+    # request needs them, and checkpoint runs a previous process abandoned
+    bridge = get_claude_bridge()
+    get_tracer()
+
+    cli_version = await bridge.preflight()
+    if cli_version:
+        logger.info("Claude CLI ready: %s", cli_version)
+    else:
+        logger.warning("Claude CLI not runnable at %s", settings.claude_cli_path)
+
+    orphaned = bridge.reconcile_interrupted_logs()
+    if orphaned:
+        logger.warning("Marked %d orphaned agent run(s) as interrupted", orphaned)
+
+    yield
+
+    # Shutdown: refuse new runs, give in-flight agents until the deadline,
+    # then checkpoint whatever is left. Pipelines run as bridge-owned tasks
+    # rather than BackgroundTasks, so uvicorn doesn't hold shutdown for them
+    # before this point. Log and trace writes are unbuffered, so there is
+    # nothing further to flush.
+    interrupted = await bridge.drain(settings.shutdown_drain_timeout)
+    if interrupted:
+        logger.warning("Interrupted %d agent run(s) on shutdown", interrupted)
+
+    reason = "Interrupted by server shutdown"
+    projects.interrupt_running_pipelines(reason)
+    agents.interrupt_running_agents(reason)
+
 
 app = FastAPI(
     title=settings.app_name,
     description="Prompt-to-Deploy: AI agents that build and deploy web applications",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -32,6 +32,11 @@ class ProjectCreate(BaseModel):
     name: Optional[str] = Field(None, description="Optional project name")
 
 
+class ProjectRebuild(BaseModel):
+    prompt: Optional[str] = Field(None, min_length=10, description="Updated prompt; omit to rebuild with the current one")
+    overlap: bool = Field(False, description="Start stages from streamed upstream handover fields")
+
+
 class ProjectResponse(BaseModel):
     id: str
     name: str
@@ -62,6 +67,11 @@ class AgentStatusResponse(BaseModel):
     completed_at: Optional[datetime] = None
     output: Optional[str] = None
     error: Optional[str] = None
+    reused: bool = False
+
+
+class PipelineStartRequest(BaseModel):
+    overlap: bool = Field(False, description="Start stages from streamed upstream handover fields")
 
 
 class AgentPipelineStatus(BaseModel):
@@ -82,6 +92,32 @@ class AgentHandover(BaseModel):
     context: dict = {}
 
 
+# Tracing Schemas
+class TraceSpan(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    depth: int
+    start_ms: float = Field(..., description="Offset from the start of the project's first span")
+    duration_ms: float
+    attributes: dict = {}
+
+
+class TraceHotspot(BaseModel):
+    name: str
+    count: int
+    total_ms: float
+
+
+class ProjectTimeline(BaseModel):
+    project_id: str
+    trace_ids: list[str]
+    duration_ms: float
+    spans: list[TraceSpan]
+    hotspots: list[TraceHotspot]
+
+
 # Health Check
 class HealthResponse(BaseModel):
     status: str = "ok"
@@ -0,0 +1,195 @@
+import asyncio
+import os
+
+import pytest
+
+from app.core import claude_bridge, tracing
+from app.core.config import Settings
+
+
+@pytest.fixture
+def bridge(tmp_path, monkeypatch):
+    cli = tmp_path / "claude"
+    cli.write_text("#!/bin/sh\nexec sleep 5\n")
+    cli.chmod(0o755)
+
+    settings = Settings(
+        claude_cli_path=str(cli),
+        agent_logs_dir=str(tmp_path / "logs"),
+        tracing_enabled=False
+    )
+    monkeypatch.setattr(tracing, "get_settings", lambda: settings)
+    monkeypatch.setattr(tracing, "_tracer", None)
+    monkeypatch.setattr(claude_bridge, "get_settings", lambda: settings)
+    return claude_bridge.ClaudeBridge()
+
+
+def test_reconcile_marks_orphaned_runs_interrupted(bridge):
+    started = {"timestamp": "t1", "project_id": "p1", "agent": "design-architect-agent", "status": "started"}
+    finished = {**started, "timestamp": "t0"}
+    for entry in (finished, {**finished, "status": "completed"}, started):
+        bridge._write_log("p1", entry)
+
+    assert bridge.reconcile_interrupted_logs() == 1
+    assert bridge.reconcile_interrupted_logs() == 0
+
+    logs = bridge.get_project_logs("p1")
+    assert logs[-1]["timestamp"] == "t1"
+    assert logs[-1]["status"] == "interrupted"
+
+
+def test_reconcile_skips_a_torn_last_line(bridge):
+    started = {"timestamp": "t1", "project_id": "p1", "agent": "design-architect-agent", "status": "started"}
+    bridge._write_log("p1", started)
+    with open(bridge.logs_dir / "p1.jsonl", "a") as f:
+        f.write('{"timestamp": "t2", "proj')
+
+    assert bridge.reconcile_interrupted_logs() == 1
+    assert bridge.reconcile_interrupted_logs() == 0
+
+    statuses = [entry["status"] for entry in bridge.get_project_logs("p1")]
+    assert statuses == ["started", "interrupted"]
+
+
+def test_drain_interrupts_runs_past_the_deadline(bridge):
+    async def scenario():
+        run = asyncio.create_task(bridge.invoke_agent("devops-agent", "deploy", "p1"))
+        while not bridge._processes:
+            await asyncio.sleep(0.01)
+
+        assert await bridge.drain(timeout=0.1) == 1
+        return await run
+
+    result = asyncio.run(scenario())
+
+    assert not result["success"]
+    assert result["error"] == "Interrupted by server shutdown"
+    assert not bridge.accepting_runs
+    statuses = [entry["status"] for entry in bridge.get_project_logs("p1")]
+    assert statuses == ["started", "interrupted"]
+
+
+def test_concurrent_identical_invocations_share_one_run(bridge, tmp_path):
+    runs = tmp_path / "runs"
+    cli = tmp_path / "streaming-claude"
+    cli.write_text(
+        "#!/bin/sh\n"
+        f"echo run >> {runs}\n"
+        "echo '{\"type\": \"assistant\", \"message\": {\"content\": [{\"type\": \"text\", \"text\": \"palette\"}]}}'\n"
+        "sleep 0.2\n"
+        "echo '{\"type\": \"result\", \"result\": \"done\"}'\n"
+    )
+    cli.chmod(0o755)
+    bridge.settings.claude_cli_path = str(cli)
+
+    async def scenario():
+        first_chunks, second_chunks = [], []
+        first = asyncio.create_task(
+            bridge.invoke_agent("design-architect-agent", "design", "p1", on_output=first_chunks.append)
+        )
+        await asyncio.sleep(0.1)
+        second = await bridge.invoke_agent("design-architect-agent", "design", "p1", on_output=second_chunks.append)
+        return await first, second, first_chunks, second_chunks
+
+    first, second, first_chunks, second_chunks = asyncio.run(scenario())
+
+    assert runs.read_text().count("run") == 1
+    assert first == second
+    assert first["success"]
+    assert first_chunks == second_chunks == ["palette"]
+    assert not bridge._flights
+
+
+def test_stream_callback_error_kills_cli(bridge, tmp_path):
+    pid_file = tmp_path / "pid"
+    cli = tmp_path / "streaming-claude"
+    cli.write_text(
+        "#!/bin/sh\n"
+        f"echo $$ > {pid_file}\n"
+        "echo '{\"type\": \"assistant\", \"message\": {\"content\": [{\"type\": \"text\", \"text\": \"plan\"}]}}'\n"
+        "exec sleep 30\n"
+    )
+    cli.chmod(0o755)
+    bridge.settings.claude_cli_path = str(cli)
+
+    def broken_callback(text):
+        raise RuntimeError("callback bug")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(bridge._stream_command([str(cli)], None, broken_callback))
+
+    assert not bridge._processes
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
+
+
+def test_preflight_gives_up_on_a_hanging_cli(bridge, monkeypatch):
+    monkeypatch.setattr(claude_bridge, "PREFLIGHT_TIMEOUT", 0.1)
+
+    assert asyncio.run(bridge.preflight()) is None
+    assert bridge.cli_version is None
+    assert not bridge._processes
+
+
+def _streaming_cli(tmp_path, seconds):
+    cli = tmp_path / "streaming-claude"
+    cli.write_text(
+        "#!/bin/sh\n"
+        "echo '{\"type\": \"assistant\", \"message\": {\"content\": [{\"type\": \"text\", \"text\": \"plan\"}]}}'\n"
+        f"sleep {seconds}\n"
+        "echo '{\"type\": \"result\", \"result\": \"done\"}'\n"
+    )
+    cli.chmod(0o755)
+    return str(cli)
+
+
+def test_streaming_call_does_not_attach_to_a_non_streaming_run(bridge, tmp_path):
+    bridge.settings.claude_cli_path = _streaming_cli(tmp_path, 0.2)
+
+    async def scenario():
+        chunks = []
+        plain = asyncio.create_task(bridge.invoke_agent("orchestrator-agent", "plan", "p1"))
+        await asyncio.sleep(0.05)
+        streamed = await bridge.invoke_agent("orchestrator-agent", "plan", "p1", on_output=chunks.append)
+        return await plain, streamed, chunks
+
+    plain, streamed, chunks = asyncio.run(scenario())
+
+    assert plain["success"] and streamed["success"]
+    assert chunks == ["plan"]
+
+
+def test_broken_subscriber_does_not_fail_shared_run(bridge, tmp_path):
+    bridge.settings.claude_cli_path = _streaming_cli(tmp_path, 0.2)
+
+    def broken_callback(text):
+        raise RuntimeError("callback bug")
+
+    async def scenario():
+        chunks = []
+        broken = asyncio.create_task(
+            bridge.invoke_agent("design-architect-agent", "design", "p1", on_output=broken_callback)
+        )
+        await asyncio.sleep(0.05)
+        healthy = await bridge.invoke_agent("design-architect-agent", "design", "p1", on_output=chunks.append)
+        return await broken, healthy, chunks
+
+    broken, healthy, chunks = asyncio.run(scenario())
+
+    assert broken["success"]
+    assert healthy["success"]
+    assert chunks == ["plan"]
+
+
+def test_call_after_last_waiter_cancels_starts_a_new_run(bridge, tmp_path):
+    bridge.settings.claude_cli_path = _streaming_cli(tmp_path, 0.2)
+
+    async def scenario():
+        first = asyncio.create_task(bridge.invoke_agent("design-architect-agent", "design", "p1"))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not bridge._flights
+        return await bridge.invoke_agent("design-architect-agent", "design", "p1")
+
+    assert asyncio.run(scenario())["success"]
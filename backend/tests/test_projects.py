@@ -0,0 +1,297 @@
+import asyncio
+import json
+import time
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.routes import projects
+from app.core import claude_bridge, tracing
+from app.core.config import Settings
+from app import main
+from app.main import app
+from app.models.schemas import AgentType, ProjectStatus
+
+
+class FakeBridge(claude_bridge.ClaudeBridge):
+    """Records invocations instead of spawning the Claude CLI."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.outputs = {}
+        self.prompts = {}
+
+    async def _invoke_agent(self, agent_name, prompt, project_id, working_dir, context, on_output):
+        self.calls.append(agent_name)
+        self.prompts[agent_name] = prompt
+        # Like the CLI's --output-format json envelope, metadata varies per run
+        envelope = {
+            "type": "result",
+            "subtype": "success",
+            "result": self.outputs.get(agent_name, f"{agent_name} output"),
+            "session_id": str(uuid4()),
+            "duration_ms": len(self.calls),
+            "total_cost_usd": 0.01 * len(self.calls)
+        }
+        return {
+            "success": True,
+            "output": json.dumps(envelope),
+            "error": "",
+            "agent": agent_name,
+            "project_id": project_id
+        }
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    test_settings = Settings(
+        claude_cli_path=str(tmp_path / "missing-claude"),
+        agent_logs_dir=str(tmp_path / "logs"),
+        agent_traces_dir=str(tmp_path / "traces")
+    )
+    monkeypatch.setattr(claude_bridge, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(tracing, "get_settings", lambda: test_settings)
+    monkeypatch.setattr(tracing, "_tracer", None)
+    return test_settings
+
+
+@pytest.fixture
+def bridge_class():
+    return FakeBridge
+
+
+@pytest.fixture
+def bridge(settings, bridge_class, monkeypatch):
+    fake = bridge_class()
+    monkeypatch.setattr(claude_bridge, "_bridge", fake)
+    return fake
+
+
+@pytest.fixture
+def client(bridge):
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def _wait_until_settled(client, project_id):
+    """Wait for the project's background run to finish."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        project = client.get(f"/api/v1/projects/{project_id}").json()
+        if project["status"] != "in_progress":
+            return project
+        time.sleep(0.01)
+    raise AssertionError("pipeline did not finish")
+
+
+def _create_project(client):
+    response = client.post("/api/v1/projects/", json={"prompt": "A todo app with tags"})
+    return response.json()["id"]
+
+
+def test_rebuild_reuses_unchanged_stages(client, bridge):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+    _wait_until_settled(client, project_id)
+    assert len(bridge.calls) == 5
+
+    bridge.calls.clear()
+    response = client.post(f"/api/v1/projects/{project_id}/rebuild", json={})
+    assert response.status_code == 200
+    assert _wait_until_settled(client, project_id)["status"] == "completed"
+    assert bridge.calls == []
+
+    pipeline = client.get(f"/api/v1/projects/{project_id}/pipeline").json()
+    assert all(agent["reused"] for agent in pipeline["agents"])
+    assert all(agent["output"] == f'{agent["agent"]} output' for agent in pipeline["agents"])
+
+
+def test_prompt_edit_with_unchanged_plan_reruns_only_orchestrator(client, bridge):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+    _wait_until_settled(client, project_id)
+
+    bridge.calls.clear()
+    client.post(
+        f"/api/v1/projects/{project_id}/rebuild",
+        json={"prompt": "A todo app with tags!"}
+    )
+    assert _wait_until_settled(client, project_id)["prompt"].endswith("tags!")
+    assert bridge.calls == [AgentType.ORCHESTRATOR.value]
+
+    pipeline = client.get(f"/api/v1/projects/{project_id}/pipeline").json()
+    reused = {agent["agent"] for agent in pipeline["agents"] if agent["reused"]}
+    assert reused == {agent.value for agent in projects.AGENT_ORDER[1:]}
+
+
+def test_rebuild_reruns_stages_downstream_of_a_changed_plan(client, bridge):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+    _wait_until_settled(client, project_id)
+
+    bridge.calls.clear()
+    bridge.outputs[AgentType.ORCHESTRATOR.value] = "plan with due dates"
+    client.post(
+        f"/api/v1/projects/{project_id}/rebuild",
+        json={"prompt": "A todo app with tags and due dates"}
+    )
+    _wait_until_settled(client, project_id)
+    assert len(bridge.calls) == 5
+    assert all("tags and due dates" in prompt for prompt in bridge.prompts.values())
+
+
+def test_rebuild_rejected_while_pipeline_in_progress(client, bridge):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+    _wait_until_settled(client, project_id)
+
+    # Between stages no agent is running, but the pipeline is not done
+    projects._projects[project_id].status = ProjectStatus.IN_PROGRESS
+    response = client.post(f"/api/v1/projects/{project_id}/rebuild", json={})
+    assert response.status_code == 409
+
+
+class StreamingBridge(FakeBridge):
+    """Streams handover fields, then holds the orchestrator and design
+    stages open until the frontend stage has been launched from them."""
+
+    def __init__(self):
+        super().__init__()
+        self.frontend_started = asyncio.Event()
+        self.contexts = {}
+
+    async def _invoke_agent(self, agent_name, prompt, project_id, working_dir, context, on_output):
+        self.contexts[agent_name] = context
+        if agent_name == AgentType.FRONTEND.value:
+            self.frontend_started.set()
+        if on_output:
+            for fields in projects.STAGE_HANDOVER_FIELDS.values():
+                for field in fields:
+                    on_output(f'@handover {field} ["{field}-value"]\n')
+        if agent_name in (AgentType.ORCHESTRATOR.value, AgentType.DESIGN.value):
+            await asyncio.wait_for(self.frontend_started.wait(), timeout=1)
+        return await super()._invoke_agent(agent_name, prompt, project_id, working_dir, context, on_output)
+
+
+@pytest.mark.parametrize("bridge_class", [StreamingBridge])
+def test_overlap_starts_stage_from_streamed_fields(client, bridge):
+    project_id = _create_project(client)
+
+    response = client.post(
+        f"/api/v1/projects/{project_id}/pipeline/start",
+        json={"overlap": True}
+    )
+    assert response.status_code == 200
+    assert _wait_until_settled(client, project_id)["status"] == "completed"
+
+    design_handover = bridge.contexts[AgentType.FRONTEND.value][AgentType.DESIGN.value]
+    assert design_handover["partial"] is True
+    assert design_handover["color_palette"] == ["color_palette-value"]
+    assert design_handover["components"] == ["components-value"]
+
+    plan_handover = bridge.contexts[AgentType.FRONTEND.value][AgentType.ORCHESTRATOR.value]
+    assert plan_handover["partial"] is True
+    assert plan_handover["tech_stack"] == ["tech_stack-value"]
+
+
+@pytest.mark.parametrize("bridge_class", [StreamingBridge])
+@pytest.mark.parametrize("overlap", [False, True])
+def test_rebuild_after_overlap_run_reuses_every_stage(client, bridge, overlap):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start", json={"overlap": True})
+    _wait_until_settled(client, project_id)
+
+    bridge.calls.clear()
+    client.post(f"/api/v1/projects/{project_id}/rebuild", json={"overlap": overlap})
+    assert _wait_until_settled(client, project_id)["status"] == "completed"
+    assert bridge.calls == []
+
+
+class SlowFrontendBridge(StreamingBridge):
+    """Keeps the frontend stage running until the backend stage launched
+    from its streamed fields has finished."""
+
+    def __init__(self):
+        super().__init__()
+        self.backend_finished = asyncio.Event()
+        self.events = []
+
+    async def _invoke_agent(self, agent_name, prompt, project_id, working_dir, context, on_output):
+        self.events.append(f"start {agent_name}")
+        result = await super()._invoke_agent(agent_name, prompt, project_id, working_dir, context, on_output)
+        if agent_name == AgentType.FRONTEND.value:
+            await asyncio.wait_for(self.backend_finished.wait(), timeout=1)
+            await asyncio.sleep(0.05)
+        self.events.append(f"end {agent_name}")
+        if agent_name == AgentType.BACKEND.value:
+            self.backend_finished.set()
+        return result
+
+
+@pytest.mark.parametrize("bridge_class", [SlowFrontendBridge])
+def test_overlap_stage_without_handover_fields_waits_for_all_earlier_stages(client, bridge):
+    project_id = _create_project(client)
+
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start", json={"overlap": True})
+    assert _wait_until_settled(client, project_id)["status"] == "completed"
+
+    # devops pushes the repository, so it must not start while frontend runs
+    frontend_end = bridge.events.index(f"end {AgentType.FRONTEND.value}")
+    assert bridge.events.index(f"end {AgentType.BACKEND.value}") < frontend_end
+    assert frontend_end < bridge.events.index(f"start {AgentType.DEVOPS.value}")
+    assert AgentType.FRONTEND.value in bridge.contexts[AgentType.DEVOPS.value]
+
+
+def test_timeline_links_pipeline_spans_to_start_request(client, bridge):
+    project_id = _create_project(client)
+    client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+    _wait_until_settled(client, project_id)
+
+    timeline = client.get(f"/api/v1/projects/{project_id}/timeline").json()
+    spans = {span["name"]: span for span in timeline["spans"]}
+
+    assert len(timeline["trace_ids"]) == 1
+    assert spans["start_project_pipeline"]["depth"] == 0
+    assert spans["run_pipeline"]["parent_id"] is None
+    assert spans["run_pipeline"]["trace_id"] == spans["start_project_pipeline"]["trace_id"]
+    assert {hotspot["name"] for hotspot in timeline["hotspots"]} == {"start_project_pipeline", "run_pipeline"}
+
+    trace = client.get(f"/api/v1/projects/{project_id}/trace").json()
+    assert all(event["ph"] == "X" for event in trace["traceEvents"])
+
+
+class HangingBridge(FakeBridge):
+    """Never finishes an agent run."""
+
+    async def _invoke_agent(self, agent_name, prompt, project_id, working_dir, context, on_output):
+        self.calls.append(agent_name)
+        await asyncio.sleep(30)
+
+
+@pytest.mark.parametrize("bridge_class", [HangingBridge])
+def test_shutdown_drains_running_pipeline(bridge, settings, monkeypatch):
+    settings.shutdown_drain_timeout = 0.1
+    monkeypatch.setattr(main, "settings", settings)
+    monkeypatch.setattr(claude_bridge, "RUN_UNWIND_TIMEOUT", 0.1)
+
+    with TestClient(app) as client:
+        project_id = _create_project(client)
+        client.post(f"/api/v1/projects/{project_id}/pipeline/start")
+        while not bridge.calls:
+            time.sleep(0.01)
+
+    assert not bridge.accepting_runs
+    assert not bridge._runs
+    assert bridge.calls == [AgentType.ORCHESTRATOR.value]
+    assert projects._projects[project_id].status == ProjectStatus.FAILED
+    orchestrator = projects._pipeline_states[project_id][AgentType.ORCHESTRATOR.value]
+    assert orchestrator.status.value == "failed"
+
+
+def test_handover_fields_require_valid_json():
+    assert projects._parse_handover_fields('@handover tech_stack ["react"]Next, features:') == {}
+    assert projects._parse_handover_fields('@handover tech_stack ["react"]\nNext, features:') == {
+        "tech_stack": ["react"]
+    }